@@ -21,64 +21,156 @@ should be stored in a `.env` file or environment variables. See the
 provided `.env.example` for details.
 """
 
-import os
+from __future__ import annotations
+
+import argparse
 import asyncio
 import logging
+import os
 from datetime import datetime, time, timedelta
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo
 
-import discord
-import pytz
-from discord.ext import commands, tasks
-from dotenv import load_dotenv
+if TYPE_CHECKING:
+    import discord
+    from discord.ext import commands, tasks
 
 
-# Load environment variables from a .env file if present
-load_dotenv()
+# Maximum number of direct messages sent concurrently
+DM_CONCURRENCY = 10
 
-# Read configuration from environment
-TOKEN = os.getenv("DISCORD_TOKEN")
-REPORT_CHANNEL_ID = os.getenv("REPORT_CHANNEL_ID")
-if REPORT_CHANNEL_ID is None:
-    raise RuntimeError(
-        "REPORT_CHANNEL_ID is not set. Please provide a channel ID in your .env file or environment."
-    )
-REPORT_CHANNEL_ID = int(REPORT_CHANNEL_ID)
-
-# Optional: Limit eligibility to a hard‑coded list of user IDs
-TARGET_MEMBER_IDS = {
-    int(uid.strip())
-    for uid in os.getenv("TARGET_MEMBER_IDS", "").split(",")
-    if uid.strip().isdigit()
-}
-if TARGET_MEMBER_IDS:
-    logger = logging.getLogger("weekly_report_bot")
-    logger.info("Filtering eligible members to IDs: %s", TARGET_MEMBER_IDS)
+# Discord rejects messages longer than this many characters
+MESSAGE_CHAR_LIMIT = 2000
 
 # Define the timezone for all time calculations (KST: UTC+9)
-KST = pytz.timezone("Asia/Seoul")
-
-# Configure Discord intents
-# intents = commands.Intents(
-#     guilds=True,
-#     members=True,
-#     messages=True,
-#     message_content=True,
-# )
-
-intents = discord.Intents.default()      # ✅ 이게 맞음
-intents.message_content = True
-intents.members = True
-
-# Create bot instance
-bot = commands.Bot(command_prefix="!", intents=intents)
+KST = ZoneInfo("Asia/Seoul")
+
 logger = logging.getLogger("weekly_report_bot")
 logging.basicConfig(level=logging.INFO)
 
+# Configuration and the bot instance are set up by _init(), so that importing
+# discord.py and reading the environment is deferred until the bot actually runs
+# (e.g. `python bot.py --help` stays cheap).
+TOKEN: str | None = None
+REPORT_CHANNEL_ID: int = 0
+TARGET_MEMBER_IDS: frozenset[int] = frozenset()
+bot: commands.Bot | None = None
+check_reports_loop: tasks.Loop | None = None
+
+
+def _init() -> None:
+    """Import discord.py, read configuration and create the bot instance."""
+    global discord, commands, tasks
+    global TOKEN, REPORT_CHANNEL_ID, TARGET_MEMBER_IDS, bot, check_reports_loop
+
+    import discord
+    from discord.ext import commands, tasks
+    from dotenv import load_dotenv
+
+    # Load environment variables from a .env file if present
+    load_dotenv()
+
+    # Read configuration from environment
+    TOKEN = os.getenv("DISCORD_TOKEN")
+    report_channel_id = os.getenv("REPORT_CHANNEL_ID")
+    if report_channel_id is None:
+        raise RuntimeError(
+            "REPORT_CHANNEL_ID is not set. Please provide a channel ID in your .env file or environment."
+        )
+    REPORT_CHANNEL_ID = int(report_channel_id)
+
+    # Optional: Limit eligibility to a hard‑coded list of user IDs
+    TARGET_MEMBER_IDS = frozenset(
+        int(uid.strip())
+        for uid in os.getenv("TARGET_MEMBER_IDS", "").split(",")
+        if uid.strip().isdigit()
+    )
+    if TARGET_MEMBER_IDS:
+        logger.info("Filtering eligible members to IDs: %s", TARGET_MEMBER_IDS)
+
+    # Configure Discord intents
+    # intents = commands.Intents(
+    #     guilds=True,
+    #     members=True,
+    #     messages=True,
+    #     message_content=True,
+    # )
+
+    intents = discord.Intents.default()      # ✅ 이게 맞음
+    # message_content is intentionally not requested: reports are read via
+    # channel.history and only author IDs are used. Commands therefore have to be
+    # invoked by mentioning the bot (e.g. "@bot check"), since mention messages
+    # still carry their content without the privileged intent.
+    intents.members = True
+
+    # Optional: Shard the gateway connection for large guilds (Discord requires
+    # sharding from 2500 guilds; it also spreads member chunking across shards)
+    bot_options = {}
+    bot_class = commands.Bot
+    shard_count = os.getenv("SHARD_COUNT", "").strip()
+    if shard_count.isdigit() and int(shard_count) > 1:
+        bot_class = commands.AutoShardedBot
+        bot_options["shard_count"] = int(shard_count)
+        logger.info("Running with %s shards", shard_count)
+
+    # Create bot instance. With a target list only a handful of members are ever
+    # read, so skip caching (and chunking) the whole guild and fetch them on demand.
+    bot = bot_class(
+        command_prefix=commands.when_mentioned_or("!"),
+        intents=intents,
+        member_cache_flags=(
+            discord.MemberCacheFlags.none()
+            if TARGET_MEMBER_IDS
+            else discord.MemberCacheFlags.from_intents(intents)
+        ),
+        chunk_guilds_at_startup=not TARGET_MEMBER_IDS,
+        **bot_options,
+    )
+    bot.event(on_ready)
+    bot.command()(commands.has_permissions(administrator=True)(check))
+    check_reports_loop = tasks.loop(time=time(hour=0, minute=5, tzinfo=KST))(_check_reports_loop)
+
+
+# Report channel resolved once in on_ready and reused by every check
+_report_channel: discord.abc.GuildChannel | None = None
+
+# Outcome of the last notification sent: (window start, non-reporter IDs).
+# Used to avoid re-posting identical results, e.g. when the check command is
+# invoked repeatedly for the same window.
+_last_report_state: tuple[datetime, frozenset[int]] | None = None
+
+
+async def _resolve_report_channel() -> discord.abc.GuildChannel | None:
+    """Return the report channel, preferring the gateway cache over the REST API."""
+    channel = bot.get_channel(REPORT_CHANNEL_ID)
+    if channel is not None:
+        return channel
+    try:
+        return await bot.fetch_channel(REPORT_CHANNEL_ID)
+    except discord.NotFound:
+        logger.error("Channel ID %s not found or inaccessible", REPORT_CHANNEL_ID)
+    except discord.Forbidden:
+        logger.error("Missing permissions to access channel ID %s", REPORT_CHANNEL_ID)
+    except discord.HTTPException as e:
+        logger.error("Failed to fetch channel ID %s: %s", REPORT_CHANNEL_ID, e)
+    return None
+
 
-@bot.event
 async def on_ready() -> None:
     """Called when the bot is connected and ready."""
+    global _report_channel
     logger.info("Bot online: %s", bot.user)
+    _report_channel = await _resolve_report_channel()
+    # Populate the member cache once so daily checks can skip fetch_members
+    for guild in bot.guilds:
+        if TARGET_MEMBER_IDS or guild.chunked:
+            continue
+        try:
+            await guild.chunk(cache=True)
+        except discord.Forbidden:
+            logger.error("Missing permissions to chunk members in guild ID %s", guild.id)
+        except discord.HTTPException as e:
+            logger.error("Failed to chunk members in guild ID %s: %s", guild.id, e)
     if not check_reports_loop.is_running():
         check_reports_loop.start()
 
@@ -90,44 +182,41 @@ def _today_range() -> tuple[datetime, datetime]:
     at the previous day's window to allow for late checks just after midnight.
     """
     now = datetime.now(KST)
-    start = now.replace(hour=18, minute=0, second=0, microsecond=0)
-    end = now.replace(hour=23, minute=59, second=59, microsecond=0)
-    # If we're in the early morning hours, adjust to yesterday's window
-    if now.hour < 6:
-        start -= timedelta(days=1)
-        end -= timedelta(days=1)
+    # If we're in the early morning hours, anchor to yesterday's window
+    anchor = now.date() - timedelta(days=1 if now.hour < 6 else 0)
+    start = datetime.combine(anchor, time(hour=18), tzinfo=KST)
+    end = datetime.combine(anchor, time(hour=23, minute=59, second=59), tzinfo=KST)
     return start, end
 
 
-@tasks.loop(time=time(hour=0, minute=5, tzinfo=KST))
-async def check_reports_loop() -> None:
+async def _check_reports_loop() -> None:
     """Check the report channel for messages in the report window and notify non-reporters."""
     start, end = _today_range()
     await check_reports(start, end)
 
 
-async def check_reports(custom_start: datetime | None = None, custom_end: datetime | None = None) -> None:
+async def check_reports(
+    custom_start: datetime | None = None,
+    custom_end: datetime | None = None,
+    channel: discord.abc.GuildChannel | None = None,
+) -> None:
     """Check the report channel for messages in the given report window and notify non-reporters.
 
     If no custom_start and custom_end are provided, defaults to today's window.
+    If no channel is provided, the one resolved in on_ready is reused and only
+    looked up again when it is not available yet.
     """
+    global _last_report_state
+
     if custom_start is None or custom_end is None:
         custom_start, custom_end = _today_range()
 
-    # 이 부분 변경
-    # channel = bot.get_channel(REPORT_CHANNEL_ID)
-    try:
-        channel = await bot.fetch_channel(REPORT_CHANNEL_ID)
-    except discord.NotFound:
-        logger.error("Channel ID %s not found or inaccessible", REPORT_CHANNEL_ID)
-        return
-    except discord.Forbidden:
-        logger.error("Missing permissions to access channel ID %s", REPORT_CHANNEL_ID)
-        return
-    except discord.HTTPException as e:
-        logger.error("Failed to fetch channel ID %s: %s", REPORT_CHANNEL_ID, e)
-        return
-
+    if channel is None:
+        channel = _report_channel
+    if channel is None:
+        channel = await _resolve_report_channel()
+        if channel is None:
+            return
 
     start, end = custom_start, custom_end
     logger.info(
@@ -136,19 +225,6 @@ async def check_reports(custom_start: datetime | None = None, custom_end: dateti
         end.isoformat(),
         REPORT_CHANNEL_ID,
     )
-    # Collect user IDs of those who sent messages during the window
-    try:
-        reporters = {
-            message.author.id
-            async for message in channel.history(after=start, before=end, limit=None)
-        }
-    except discord.Forbidden:
-        logger.error("Missing permissions to read message history in channel ID %s", REPORT_CHANNEL_ID)
-        return
-    except discord.HTTPException as e:
-        logger.error("Failed to read message history in channel ID %s: %s", REPORT_CHANNEL_ID, e)
-        return
-
     # Ensure guild and bot.user are properly connected
     if channel.guild is None:
         logger.error("Channel ID %s does not belong to a guild", REPORT_CHANNEL_ID)
@@ -157,21 +233,65 @@ async def check_reports(custom_start: datetime | None = None, custom_end: dateti
         logger.error("Bot user is not available")
         return
 
+    # permissions_for walks the member's roles and the channel overwrites on
+    # every call. Members with the same role set always resolve to the same
+    # result unless they own the guild or have a member-specific overwrite,
+    # so memoize the outcome per role set and only special-case those members.
+    member_overwrite_ids = {
+        target.id for target in channel.overwrites if not isinstance(target, discord.Role)
+    }
+    member_overwrite_ids.add(channel.guild.owner_id)
+    read_by_roles: dict[tuple[int, ...], bool] = {}
+
     def _can_read(channel: discord.abc.GuildChannel, member: discord.Member) -> bool:
         """Safely check if member can read the channel, falling back to False on errors."""
         try:
-            return channel.permissions_for(member).read_messages
+            if member.id in member_overwrite_ids:
+                return channel.permissions_for(member).read_messages
+            # Member._roles is the sorted list of role IDs permissions_for uses itself
+            key = tuple(member._roles)
+            can_read = read_by_roles.get(key)
+            if can_read is None:
+                can_read = read_by_roles[key] = channel.permissions_for(member).read_messages
+            return can_read
         except AttributeError:
             # In rare cases member or default role is incomplete in cache
             return False
 
-    # --- Build the list of members who can see this channel (exclude bots) ---
-    eligible_members: list[discord.Member] = []
+    async def _iter_members():
+        """Yield candidate members from the cheapest available source."""
+        if TARGET_MEMBER_IDS:
+            # Only resolve the targeted IDs instead of walking the whole guild
+            for uid in TARGET_MEMBER_IDS:
+                member = channel.guild.get_member(uid)
+                if member is None:
+                    try:
+                        member = await channel.guild.fetch_member(uid)
+                    except discord.NotFound:
+                        logger.warning("Target member ID %s not found in guild ID %s", uid, channel.guild.id)
+                        continue
+                    except discord.HTTPException as e:
+                        logger.warning("Failed to fetch target member ID %s: %s", uid, e)
+                        continue
+                yield member
+        elif channel.guild.chunked:
+            # Member cache is populated over the gateway (see on_ready)
+            for member in channel.guild.members:
+                yield member
+        else:
+            # Cache not ready yet (e.g. --once mode racing on_ready): use the HTTP endpoint
+            async for member in channel.guild.fetch_members(limit=None):
+                yield member
+
+    # --- Collect members who can see this channel (exclude bots) ---
+    # Members stay pending until they are seen in the report window, so the
+    # same mapping ends up holding exactly the non-reporters.
+    pending: dict[int, discord.Member] = {}
     try:
-        # Always fetch from the HTTP endpoint to avoid cache issues
-        async for member in channel.guild.fetch_members(limit=None):
-            if not member.bot and _can_read(channel, member):
-                eligible_members.append(member)
+        async for member in _iter_members():
+            if member.bot or not _can_read(channel, member):
+                continue
+            pending[member.id] = member
     except discord.Forbidden:
         logger.error(
             "Missing permissions to fetch members in guild ID %s", channel.guild.id
@@ -183,52 +303,85 @@ async def check_reports(custom_start: datetime | None = None, custom_end: dateti
         )
         return
 
-    # If a target ID list is provided, filter to those IDs only
-    if TARGET_MEMBER_IDS:
-        eligible_members = [m for m in eligible_members if m.id in TARGET_MEMBER_IDS]
+    logger.info("Eligible member count in channel %s: %d", channel.id, len(pending))
 
-    logger.info(
-        "Eligible member count in channel %s: %d", channel.id, len(eligible_members)
-    )
+    # Debug: log the fetched eligible members (display_name and ID)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Eligible members: %s",
+            [f"{m.display_name} ({m.id})" for m in pending.values()],
+        )
+
+    # Drop everyone who posted during the window, stopping pagination as soon
+    # as every eligible member has been seen
+    # Pass snowflake bounds directly; these match the conversion discord.py
+    # would otherwise do for datetime arguments on every call
+    after = discord.Object(id=discord.utils.time_snowflake(start, high=True))
+    before = discord.Object(id=discord.utils.time_snowflake(end))
+    try:
+        if pending:
+            async for message in channel.history(
+                after=after, before=before, limit=None, oldest_first=True
+            ):
+                if pending.pop(message.author.id, None) is not None and not pending:
+                    break
+    except discord.Forbidden:
+        logger.error("Missing permissions to read message history in channel ID %s", REPORT_CHANNEL_ID)
+        return
+    except discord.HTTPException as e:
+        logger.error("Failed to read message history in channel ID %s: %s", REPORT_CHANNEL_ID, e)
+        return
 
-    # Debug: print the fetched eligible members (display_name and ID)
-    print(
-        "Eligible members:",
-        [f"{m.display_name} ({m.id})" for m in eligible_members],
-    )
     # Non‑reporters = eligible members who did not post during the window
-    non_reporters = [m for m in eligible_members if m.id not in reporters]
+    non_reporters = list(pending.values())
+
+    # Skip notifying again if the result for this window has not changed
+    report_state = (start, frozenset(pending))
+    if report_state == _last_report_state:
+        logger.info("Report result unchanged since last notification; skipping")
+        return
 
     # If everyone reported, send a confirmation and exit
     if not non_reporters:
         await channel.send(
             "✅ 오늘(어제 18시~자정) 주간보고 미제출자는 없습니다!"
         )
+        _last_report_state = report_state
         return
 
-    # Create mention strings for each non-reporter
-    mention_list = " ".join(member.mention for member in non_reporters)
+    # Mention each non-reporter (same format as Member.mention), splitting
+    # into several messages so none exceeds Discord's length limit
+    buffer = "⏰ 아직 주간보고를 작성하지 않은 분들입니다!\n"
+    for member_id in pending:
+        mention = f"<@{member_id}>"
+        if len(buffer) + len(mention) + 1 > MESSAGE_CHAR_LIMIT:
+            await channel.send(buffer.rstrip())
+            buffer = ""
+        buffer += mention + " "
+    if buffer:
+        await channel.send(buffer.rstrip())
+    _last_report_state = report_state
+
+    # Optionally send a direct message to each non-reporter. DMs are sent
+    # concurrently; the semaphore keeps us well under the global ratelimit.
+    dm_semaphore = asyncio.Semaphore(DM_CONCURRENCY)
+
+    async def _dm(member: discord.Member) -> None:
+        async with dm_semaphore:
+            try:
+                await member.send(
+                    "오늘 18:00~24:00 사이 주간보고가 확인되지 않았습니다. 잊지 말고 작성해주세요!"
+                )
+            except discord.Forbidden as exc:
+                logger.warning("Could not DM %s: Forbidden - %s", member, exc)
+            except discord.HTTPException as exc:
+                logger.warning("Could not DM %s: HTTPException - %s", member, exc)
+            except Exception as exc:  # catch generic exceptions so one failure doesn't cancel the rest
+                logger.warning("Could not DM %s: %s", member, exc)
+
+    await asyncio.gather(*(_dm(member) for member in non_reporters))
 
-    await channel.send(
-        f"⏰ 아직 주간보고를 작성하지 않은 분들입니다!\n{mention_list}"
-    )
 
-    # Optionally send a direct message to each non-reporter
-    for member in non_reporters:
-        try:
-            await member.send(
-                "오늘 18:00~24:00 사이 주간보고가 확인되지 않았습니다. 잊지 말고 작성해주세요!"
-            )
-        except discord.Forbidden as exc:
-            logger.warning("Could not DM %s: Forbidden - %s", member, exc)
-        except discord.HTTPException as exc:
-            logger.warning("Could not DM %s: HTTPException - %s", member, exc)
-        except Exception as exc:  # catch generic exceptions to avoid blocking loop
-            logger.warning("Could not DM %s: %s", member, exc)
-
-
-@bot.command()
-@commands.has_permissions(administrator=True)
 async def check(ctx: commands.Context) -> None:
     """Manually trigger the report check. Only accessible to administrators."""
     await check_reports()
@@ -236,8 +389,6 @@ async def check(ctx: commands.Context) -> None:
 
 def main() -> None:
     """Entry point to run the bot. Supports the --once flag for single-run mode."""
-    import argparse
-
     parser = argparse.ArgumentParser(description="Discord weekly report bot")
     parser.add_argument(
         "--once", action="store_true", help="Run the check once and exit"
@@ -253,6 +404,7 @@ def main() -> None:
         help="Custom report window end time in ISO format (e.g. 2024-06-01T23:59:59+09:00)",
     )
     args = parser.parse_args()
+    _init()
 
     if args.once:
         # Parse custom window times if provided